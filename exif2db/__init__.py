@@ -0,0 +1,4 @@
+import time
+
+# Taken before anything else of the package is imported, see STARTUP_BUDGET in __main__.
+_loaded_at = time.monotonic()
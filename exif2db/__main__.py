@@ -1,103 +1,349 @@
 import sys
 import time
 import logging
-from typing import List
+from typing import List, Set, Tuple, Optional
 from argparse import ArgumentParser
 from datetime import timedelta
 from pathlib import Path
+from dataclasses import dataclass
 from tqdm import tqdm
-from .types import Db, TimeLimit, DEFAULT_FILE_INFO, DEFAULT_EXIF_DATA
+from .types import Db, TimeLimit, FileInfo, ExifData, Method, ExtractionTimeout, DEFAULT_FILE_INFO, DEFAULT_EXIF_DATA
 from .sqlite import Sqlite
 from .file_system import FileMetadata, walk_recurse
 from .factory import Factory
+from .log import Logging, ProgressLog
+from .metrics import metrics
+from .federation import SHARD_MODES, Federation, plan_shards, shard_layout, read_manifest, write_manifest
+from .stats import print_stats
+from .scheduler import IO_ORDERS, schedule, prefetch
+from .utils import parse_method, time_limit
 from .methods.exiftool import ExifReader_Exiftool
+from . import _loaded_at
 
+# Time from import of the package to the point where work can begin, before the database
+# is opened. Readers and their plugins are loaded lazily, so they should not count here.
+STARTUP_BUDGET = timedelta(seconds=0.5)
 
-def do():
-    args = parse_arguments()
 
-    db = Sqlite(args.database)
+def do(args) -> timedelta:
+    startup = log_startup()
+    if args.metrics_file or args.metrics_port:
+        metrics.configure(args.metrics_file, args.metrics_port, args.metrics_interval, args.metrics_address)
+
+    try:
+        if args.shard and args.stats:
+            federation = Federation(args.database)
+            try:
+                # Shards store absolute paths, see plan_shards().
+                print_stats(federation, str(Path(args.path).absolute()))
+                return startup
+            finally:
+                federation.close()
+
+        if args.shard:
+            layout = shard_layout(args.shard, args.shard_count)
+            write_manifest(args.database, layout)
+            jobs = plan_shards(args.database, args.path, args.shard_root, args.shard, args.shard_count, args.exclude)
+        else:
+            layout = None
+            jobs = [(args.database, None, args.path)]
+
+        # With --shard hash, several top-level directories can share a shard: purge it only once.
+        purged = set()
+        for database, key, path in jobs:
+            db = open_db(database, args)
+            try:
+                if layout is not None:
+                    db.set_shard_info(layout['mode'], layout['count'], key)
+                if args.purge and database not in purged:
+                    purge(db)
+                    purged.add(database)
+                run(args, db, path)
+            finally:
+                db.close()
+        return startup
+    finally:
+        metrics.close()
+
+
+def log_startup() -> timedelta:
+    startup = timedelta(seconds=time.monotonic() - _loaded_at)
+    logger.info(f'Started in {startup}')
+    if startup > STARTUP_BUDGET:
+        logger.warning(f'Startup took longer than the budget of {STARTUP_BUDGET}')
+    return startup
+
+
+def open_db(database: str, args) -> Sqlite:
+    # Reported apart from startup: it grows with the database (migrations, staging copy).
+    start = time.monotonic()
+    db = Sqlite(database, args.staging, args.checkpoint)
+    logger.info(f'Opened database {database} in {timedelta(seconds=time.monotonic() - start)}')
+    return db
+
+
+def purge(db: Db):
+    logger.info('Purging database...')
+    db.reset_files_data()
+    db.reset_exif_data()
+
+
+def run(args, db: Db, path: str):
+    if args.stats:
+        print_stats(db, path)
+        return
+
+    if args.rederive:
+        rederive_metadata(db, path)
+        return
+
+    options = ExtractOptions(args.with_hash, args.raw_tags, args.reuse, args.timeout,
+                             args.io_order, args.prefetch, args.device_concurrency)
 
-    if args.purge:
-        logger.info('Purging database...')
-        db.reset_files_data()
-        db.reset_exif_data()
+    if args.reextract:
+        reextract_metadata(db, path, options, args.ext, args.mime)
+        return
 
     if args.no_scan:
         logger.debug('Skipping file scan')
     else:
-        populate_db_files(args.path, db, args.ext, args.exclude)
+        populate_db_files(path, db, args.ext, args.exclude, args.prune)
 
-    collect_metadata(db, args.path, args.with_hash)
+    collect_metadata(db, path, options)
 
-    db.close()
 
-
-def populate_db_files(path: str, db: Db, filter_ext: str, exclude: List[str]):
+def populate_db_files(path: str, db: Db, filter_ext: str, exclude: List[str], prune: bool = False):
     logger.info(f'Scanning directory {path}...')
     print('Scanning directory...')
 
-    if filter_ext:
-        filter_ext = filter_ext.lower().replace(' ', '')
-        extensions = set(e if e.startswith('.') else '.' + e for e in filter_ext.split(','))
-        do_filter = True
-    else:
-        extensions = []
-        do_filter = False
+    extensions = _parse_extensions(filter_ext)
+    do_filter = bool(extensions)
 
+    db.init_path_index()
+    if prune:
+        db.start_scan()
     root = Path(path)
+    seen = 0
     for path in tqdm(walk_recurse(root, exclude), file=sys.stdout):
+        seen += 1
         if not do_filter or path.suffix.lower() in extensions:
-            db.add_file(path)
+            if db.add_file(path):
+                metrics.inc('files_scanned_total')
         else:
             logger.debug(f'Ignoring due to extension filter: {path}')
 
-    db.commit()
+    if prune:
+        prune_db_files(db, root, seen)
+
+    with metrics.time_commit():
+        db.commit()
     logger.info(f'Directory was saved to the database')
 
 
-# noinspection PyBroadException
-def collect_metadata(db: Db, prefix: str, with_hash: bool):
+def prune_db_files(db: Db, root: Path, seen: int):
+    unseen = db.end_scan(str(root))
+    if not seen:
+        # E.g. an unmounted volume: its files are not gone, only out of reach.
+        logger.warning(f'Not pruning {len(unseen)} files: no files were found under {root}')
+        return
+
+    # Not seen because of the filters or excludes of this run is not a reason to forget a file.
+    removed = 0
+    for file_id, fpath in unseen:
+        if not Path(fpath).exists():
+            db.delete_file(file_id)
+            removed += 1
+    logger.info(f'Removed {removed} files that are no longer in the library')
+
+
+@dataclass
+class ExtractOptions:
+    with_hash: bool
+    raw_tags: bool
+    reuse: bool
+    timeout: Optional[float]
+    io_order: str = 'id'
+    prefetch: int = 0
+    device_concurrency: int = 1
+
+
+def collect_metadata(db: Db, prefix: str, options: ExtractOptions):
     logger.debug('Collecting metadata...')
     print('Collecting metadata...')
 
+    if options.reuse:
+        db.init_content_index()
+
     total_count = db.get_files_count(prefix)
     logger.debug(f'Found {total_count} unprocessed files')
-    ExifReader_Exiftool.initialize()
+    metrics.set('files_pending', total_count)
     commit_strategy = TimeLimit(10.0)
 
-    for row in tqdm(db.get_all_files(prefix), total=total_count, file=sys.stdout):
-        file_id, fpath = row
+    rows = schedule(db.get_all_files(prefix), options.io_order, options.timeout or None)
+    files = prefetch(rows, options.prefetch, options.device_concurrency, options.with_hash,
+                     options.timeout or None)
+
+    progress = ProgressLog(logger, 'Processed')
+
+    for file_id, fpath, data in tqdm(files, total=total_count, file=sys.stdout):
         path = Path(fpath)
 
-        try:
-            fi = FileMetadata(path, with_hash).collect()
-        except Exception:   # E.g. file was deleted since scan.
-            fi = DEFAULT_FILE_INFO
+        fi, exif, method, version = extract(db, file_id, path, options, data)
+        db.add_metadata(file_id, fi, exif, method, version)
+        if commit_strategy.attempt():
+            # With some storage options, committing on every iteration is very slow.
+            with metrics.time_commit():
+                db.commit()
 
-        exif_reader = Factory.get(path.suffix)
-        if exif_reader:
-            er = exif_reader(path)
-            try:
+        progress.update(path)
+        metrics.inc('files_processed_total')
+        metrics.set('files_pending', total_count - progress.count)
+
+    with metrics.time_commit():
+        db.commit()
+    progress.finish()
+    ExifReader_Exiftool.shutdown()
+
+
+def reextract_metadata(db: Db, prefix: str, options: ExtractOptions, filter_ext: str, filter_mime: List[str]):
+    """Re-run extraction for files that failed or were processed by an outdated reader version."""
+    logger.info('Re-extracting metadata...')
+    print('Re-extracting metadata...')
+
+    versions = Factory.versions()
+    logger.debug(f'Current extractor versions: {versions}')
+    rows = db.get_outdated_files(prefix, versions, _parse_extensions(filter_ext), filter_mime)
+    logger.info(f'Found {len(rows)} files to re-extract')
+    if options.reuse:
+        db.init_content_index()
+    commit_strategy = TimeLimit(10.0)
+
+    # Would fail again, no reader supports these.
+    rows = [(file_id, fpath) for file_id, fpath in rows if Factory.get(Path(fpath).suffix) is not None]
+    metrics.set('files_pending', len(rows))
+    rows = schedule(rows, options.io_order, options.timeout or None)
+    files = prefetch(rows, options.prefetch, options.device_concurrency, options.with_hash,
+                     options.timeout or None)
+
+    progress = ProgressLog(logger, 'Re-extracted')
+
+    for file_id, fpath, data in tqdm(files, total=len(rows), file=sys.stdout):
+        path = Path(fpath)
+
+        fi, exif, method, version = extract(db, file_id, path, options, data)
+        db.update_metadata(file_id, fi, exif, method, version)
+        if commit_strategy.attempt():
+            with metrics.time_commit():
+                db.commit()
+
+        progress.update(path)
+        metrics.inc('files_processed_total')
+        metrics.set('files_pending', len(rows) - progress.count)
+
+    with metrics.time_commit():
+        db.commit()
+    progress.finish()
+    ExifReader_Exiftool.shutdown()
+
+
+# noinspection PyBroadException
+def extract(db: Db, file_id: int, path: Path, options: ExtractOptions,
+            data: Optional[bytes] = None) -> Tuple[FileInfo, ExifData, Optional[str], Optional[int]]:
+    """`data` is the file content if it was read ahead; hashing and readers then share it."""
+    try:
+        fi = FileMetadata(path, options.with_hash, options.reuse).collect(data)
+    except Exception:   # E.g. file was deleted since scan.
+        fi = DEFAULT_FILE_INFO
+
+    if data is not None and len(data) != fi.size:
+        data = None     # Changed since it was read ahead: readers must see the same content as stat and hash.
+
+    if options.with_hash and fi.hash is not None:
+        metrics.inc('bytes_hashed_total', fi.size)
+
+    if options.reuse:
+        # A copy of this file (e.g. on a backup volume) may have been processed already.
+        found = db.find_by_content(file_id, fi, Factory.versions())
+        if found:
+            source_id, method, version, exif = found
+            if options.raw_tags:
+                db.copy_tags(source_id, file_id)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Reusing metadata of file ID {source_id} for {path}')
+            metrics.inc('extractions_total', method=method, result='reused')
+            return fi, exif, method, version
+
+    exif_reader = Factory.get(path.suffix)
+    if exif_reader:
+        er = exif_reader(path, data)
+        try:
+            with time_limit(options.timeout):
                 exif = er.load()
-                method = er.method.name
-            except Exception:
-                logger.exception('Error getting EXIF data')
-                exif = DEFAULT_EXIF_DATA
-                method = None
-        else:
+            method = er.method.name
+            version = er.version
+            if options.raw_tags and er.tags is not None:
+                db.add_tags(file_id, method, er.tags)
+            metrics.inc('extractions_total', method=method, result='success')
+        except ExtractionTimeout:
+            # Combined reader reports the method that was running when the time ran out.
+            stage = er.method.name
+            logger.error(f'{stage} timed out after {options.timeout}s, quarantining {path}')
+            if er.method is Method.Exiftool:
+                ExifReader_Exiftool.abort()
+            metrics.inc('extractions_total', method=stage, result='timeout')
+            db.add_quarantine(path, stage, options.timeout)
+            db.checkpoint()     # Must survive if the process has to be killed later.
+            exif = DEFAULT_EXIF_DATA
+            method = None
+            version = None
+        except Exception as e:
+            logger.error(f'Error getting EXIF data for {path}: {e!r}', exc_info=logger.isEnabledFor(logging.DEBUG))
+            metrics.inc('extractions_total', method=er.method.name, result='failure')
             exif = DEFAULT_EXIF_DATA
             method = None
+            version = None
+    else:
+        metrics.inc('extractions_total', method='none', result='unsupported')
+        exif = DEFAULT_EXIF_DATA
+        method = None
+        version = None
+
+    return fi, exif, method, version
+
+
+# noinspection PyBroadException
+def rederive_metadata(db: Db, prefix: str):
+    """Rebuild EXIF columns of "metadata" from the tags stored with --raw_tags."""
+    logger.info('Re-deriving metadata from stored tags...')
+    print('Re-deriving metadata...')
 
-        db.add_metadata(file_id, fi, exif, method)
+    total_count = db.get_tags_count(prefix)
+    logger.debug(f'Found {total_count} files with stored tags')
+    commit_strategy = TimeLimit(10.0)
+
+    for file_id, method, tags in tqdm(db.get_all_tags(prefix), total=total_count, file=sys.stdout):
+        try:
+            reader = Factory.for_method(parse_method(method))
+            exif = reader.from_tags(tags)
+        except Exception:
+            logger.exception(f'Error re-deriving metadata for file ID {file_id}')
+            continue
+
+        # Derived by the current mapping, so the row is no longer outdated for --reextract and --reuse.
+        db.update_exif_data(file_id, exif, reader.version)
         if commit_strategy.attempt():
-            # With some storage options, committing on every iteration is very slow.
             db.commit()
 
-        logger.info(f'Processed: {path}')
-
     db.commit()
-    ExifReader_Exiftool.shutdown()
+    logger.info('Metadata was re-derived')
+
+
+def _parse_extensions(filter_ext: Optional[str]) -> Set[str]:
+    if not filter_ext:
+        return set()
+
+    filter_ext = filter_ext.lower().replace(' ', '')
+    return set(e if e.startswith('.') else '.' + e for e in filter_ext.split(','))
 
 
 def parse_arguments():
@@ -107,32 +353,128 @@ def parse_arguments():
     parser.add_argument('-e', '--ext', help='Filter on these file name extensions, comma-separated list.')
     parser.add_argument('-d', '--database', help='Location of SQLite database. Defaults to ./sqlite.db',
                         default='./sqlite.db')
+    parser.add_argument('--staging', help='Work on a copy of the database at this location (":memory:" or a file '
+                                          'on tmpfs) and write it back periodically and at exit. Useful when the '
+                                          'database is on slow storage.', metavar='LOCATION')
+    parser.add_argument('--checkpoint', help='Interval in seconds for writing the staging database back. '
+                                             'Defaults to 300', metavar='SECONDS', type=float, default=300.0)
+    parser.add_argument('--shard', help='Keep a separate database per top-level directory of the library ("dir") '
+                                        'or per hash of its name ("hash"), named after --database, e.g. '
+                                        'sqlite.2019.db. With --stats, reports on all shards.', choices=SHARD_MODES)
+    parser.add_argument('--shard_count', help='Number of shards for --shard hash. Defaults to 8',
+                        metavar='N', type=int, default=8)
+    parser.add_argument('--shard_root', help='Library root the top-level directories are taken from, when path '
+                                             'is a subtree to process into its shard. Defaults to path',
+                        metavar='DIR')
     parser.add_argument('--purge', help='Purge the database if not empty.', action='store_true')
+    parser.add_argument('--prune', help='Remove files that no longer exist under path from the database, '
+                                        'with their metadata. Skipped if the scan finds no files at all.',
+                        action='store_true')
     parser.add_argument('--with_hash', help='Calculate SHA1 hash for each file', action='store_true')
     parser.add_argument('--no_scan', help='Do not perform new file scan (continue after a failure).',
                         action='store_true')
+    parser.add_argument('--timeout', help='Time budget in seconds for reading metadata of one file. Files that '
+                                          'exceed it are quarantined and skipped in later runs; 0 disables. '
+                                          'Defaults to 60', type=float, default=60.0)
+    parser.add_argument('--io_order', help='Order of processing: "id" (scan order), "inode" or "extent" '
+                                           '(physical location, reduces seeking on spinning disks). Defaults to id',
+                        choices=IO_ORDERS, default='id')
+    parser.add_argument('--prefetch', help='Number of files to read ahead in background. With --with_hash files are '
+                                           'read once for both hashing and EXIF parsing. Defaults to 0 (off)',
+                        metavar='N', type=int, default=0)
+    parser.add_argument('--device_concurrency', help='Maximum parallel reads from one device when prefetching. '
+                                                     'Defaults to 1', metavar='N', type=int, default=1)
+    parser.add_argument('--reuse', help='Copy metadata from identical files already in the database '
+                                        '(by hash, or by size and partial hash) instead of reading them.',
+                        action='store_true')
+    parser.add_argument('--stats', help='Print library statistics for the path from the database and exit.',
+                        action='store_true')
+    parser.add_argument('--raw_tags', help='Store the full extracted tag set of each file (compressed) '
+                                           'to allow --rederive later.', action='store_true')
+    parser.add_argument('--rederive', help='Rebuild metadata columns from stored tags instead of reading files.',
+                        action='store_true')
+    parser.add_argument('--reextract', help='Re-extract metadata of files that failed or were processed by an '
+                                            'outdated reader version. Honors --ext and --mime.', action='store_true')
+    parser.add_argument('--mime', help='MIME type filter for --reextract, e.g. video/mp4 or video/*. '
+                                       'Failed files are matched by the type of their extension.',
+                        action='append')
+    parser.add_argument('-v', '--verbose', help='Log every file (-v) and library debug messages (-vv).',
+                        action='count', default=0)
+    parser.add_argument('--log', help='Log file. Defaults to ./exif2db.log', metavar='FILE', default='exif2db.log')
+    parser.add_argument('--log_max_size', help='Rotate the log file when it reaches this size in MB, keeping '
+                                               '3 old files. Defaults to 0 (overwrite on every run)',
+                        metavar='MB', type=float, default=0)
+    parser.add_argument('--metrics_file', help='Periodically write progress metrics in Prometheus text format '
+                                               'to this file, e.g. for the node exporter textfile collector.',
+                        metavar='FILE')
+    parser.add_argument('--metrics_port', help='Serve progress metrics in Prometheus text format on this port.',
+                        metavar='PORT', type=int)
+    parser.add_argument('--metrics_address', help='Address to serve metrics on with --metrics_port. '
+                                                  'Defaults to 127.0.0.1 (local only)', default='127.0.0.1')
+    parser.add_argument('--metrics_interval', help='Interval in seconds for updating the metrics file and rates. '
+                                                   'Defaults to 15', metavar='SECONDS', type=float, default=15.0)
     parser.add_argument('-x', '--exclude', help='Exclude pattern for files and directories',
                         metavar='PATTERN', action='append')
     args = parser.parse_args()
-    logger.debug(f'Arguments: {args}')
 
     if not Path(args.path).is_dir():
         print('Starting path must be a directory!')
         exit(1)
 
+    if args.staging and args.staging != ':memory:':
+        if Path(args.staging).resolve() == Path(args.database).resolve():
+            print('Staging location must differ from the database!')
+            exit(1)
+        if Path(args.staging).exists():
+            # It is deleted at exit: never take over a file of someone else.
+            print('Staging file already exists! Remove it if it was left by an interrupted run.')
+            exit(1)
+
+    if args.metrics_interval <= 0:
+        print('Metrics interval must be positive!')
+        exit(1)
+
+    if args.shard_count < 1:
+        print('Shard count must be positive!')
+        exit(1)
+
+    if args.shard_root and Path(args.shard_root).absolute() not in Path(args.path).absolute().parents \
+            and Path(args.shard_root).absolute() != Path(args.path).absolute():
+        print('Path must be inside the shard root!')
+        exit(1)
+
+    if args.shard and not args.stats and args.shard_root \
+            and Path(args.shard_root).absolute() != Path(args.path).absolute():
+        layout = read_manifest(args.database)
+        if layout is not None and layout != shard_layout(args.shard, args.shard_count):
+            print(f'The database is sharded as {layout}! Change the sharding with a run on the library root.')
+            exit(1)
+
+    if args.shard and args.purge and args.shard_root \
+            and Path(args.shard_root).absolute() != Path(args.path).absolute():
+        print('Purge would empty the whole shard, including other directories! '
+              'Purge sharded databases with a run on the library root.')
+        exit(1)
+
     return args
 
 
 def main():
     start = time.monotonic()
-    do()
+    args = parse_arguments()
+    log = Logging(args.log, args.verbose, args.log_max_size)
+    logger.debug(f'Arguments: {args}')
+
+    try:
+        startup = do(args)
+    finally:
+        log.stop()
+
     end = time.monotonic()
     duration = timedelta(seconds=end-start)
+    print(f'Started in {startup} (budget {STARTUP_BUDGET})')
     print('Finished in', duration)
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logging.basicConfig(filename='exif2db.log', filemode='w', level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 main()
@@ -1,28 +1,58 @@
 import logging
-from typing import Type, Optional
-from .types import ExifReader
-from .methods.combined import ExifReader_Combined
-from .methods.exiftool import ExifReader_Exiftool
+from importlib import import_module
+from typing import Type, Optional, Dict
+from .types import ExifReader, Method
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 
 class Factory:
+    # Readers are imported on first use, so that runs which never touch a given
+    # format do not pay for loading Pillow, its plugins or PyExifTool.
+    _readers = {
+        'combined': ('.methods.combined', 'ExifReader_Combined'),
+        'exiftool': ('.methods.exiftool', 'ExifReader_Exiftool'),
+        'pillow': ('.methods.pillow', 'ExifReader_Pillow'),
+    }
+    _loaded: Dict[str, Type[ExifReader]] = {}
+
     @classmethod
     def get(cls, file_ext: str) -> Optional[Type[ExifReader]]:
         file_ext = file_ext.lower()
 
         if file_ext in ('.jpg', '.jpeg', '.heic', '.png', '.tiff', '.tif', '.bmp', '.crw',
                         '.gif', '.psd', '.nef', '.avif'):
-            if logger.level <= logging.DEBUG:
-                logger.debug(f'Returning {ExifReader_Combined.__name__} for {file_ext}')
-            return ExifReader_Combined
+            reader = cls._load('combined')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Returning {reader.__name__} for {file_ext}')
+            return reader
 
         elif file_ext in ('.orf', '.mov', '.mpg', '.mpeg', '.avi', '.mp4', '.mts', '.m2t'):
-            logger.debug(f'Returning {ExifReader_Exiftool.__name__} for {file_ext}')
-            return ExifReader_Exiftool
+            reader = cls._load('exiftool')
+            logger.debug(f'Returning {reader.__name__} for {file_ext}')
+            return reader
 
         else:
             logger.debug(f'Extension is unsupported: {file_ext}')
             return None
+
+    @classmethod
+    def for_method(cls, method: Method) -> Type[ExifReader]:
+        """Reader that produced data with the given method, e.g. to re-derive from stored tags."""
+        return cls._load(method.name.lower())
+
+    @classmethod
+    def versions(cls) -> Dict[str, int]:
+        """Current version of every reader that records itself as a method."""
+        readers = (cls.for_method(m) for m in (Method.Pillow, Method.Exiftool))
+        return {r.method.name: r.version for r in readers}
+
+    @classmethod
+    def _load(cls, name: str) -> Type[ExifReader]:
+        reader = cls._loaded.get(name)
+        if reader is None:
+            module_name, class_name = cls._readers[name]
+            logger.debug(f'Loading {class_name}...')
+            reader = getattr(import_module(module_name, __package__), class_name)
+            cls._loaded[name] = reader
+        return reader
@@ -0,0 +1,230 @@
+import zlib
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import List, Tuple, Dict, Optional, Any
+from .sqlite import METADATA_COLUMNS, STATS_TABLES
+from .file_system import _is_excluded
+
+logger = logging.getLogger(__name__)
+
+SHARD_MODES = ('dir', 'hash')
+
+# Federated IDs are the shard-local ID times this plus the shard number, so that
+# "files" and "metadata" of all shards can still be joined on "id".
+SHARD_ID_FACTOR = 1024
+
+
+def shard_key(top_level: str, mode: str, count: int) -> str:
+    """Name of the shard for a top-level directory of the library."""
+    if mode == 'dir':
+        return top_level
+    # CRC32 rather than hash(): the latter is salted per process.
+    return f'{zlib.crc32(top_level.encode()) % count:03d}'
+
+
+def shard_filename(database: str, key: str) -> str:
+    """E.g. ./sqlite.db and "2019" -> ./sqlite.2019.db"""
+    p = Path(database)
+    return str(p.with_name(f'{p.stem}.{key}{p.suffix}'))
+
+
+def manifest_filename(database: str) -> str:
+    """E.g. ./sqlite.db -> ./sqlite.shards.json"""
+    p = Path(database)
+    return str(p.with_name(f'{p.stem}.shards.json'))
+
+
+def shard_layout(mode: str, count: int) -> Dict[str, Any]:
+    return {'mode': mode, 'count': count if mode == 'hash' else None}
+
+
+def read_manifest(database: str) -> Optional[Dict[str, Any]]:
+    """Layout the shards of `database` are written with, None if it was never sharded."""
+    try:
+        with open(manifest_filename(database)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(database: str, layout: Dict[str, Any]):
+    current = read_manifest(database)
+    if current == layout:
+        return
+
+    if current is not None:
+        logger.warning(f'Sharding of {database} changes from {current} to {layout}: '
+                       f'shards of the old layout are no longer queried')
+    tmp = manifest_filename(database) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(layout, f)
+    Path(tmp).replace(manifest_filename(database))
+
+
+def find_shards(database: str) -> Dict[str, str]:
+    """Shard key -> file name of the files named like shards of `database`.
+
+    These may also be shards of an earlier layout or unrelated files; see Federation.
+    """
+    p = Path(database)
+    prefix = p.stem + '.'
+    shards = {}
+    if not p.parent.is_dir():
+        return shards
+
+    for f in sorted(p.parent.iterdir()):
+        name = f.name
+        if f.is_file() and name.startswith(prefix) and name.endswith(p.suffix) and len(name) > len(p.name):
+            shards[name[len(prefix):len(name) - len(p.suffix)]] = str(f)
+    return shards
+
+
+def plan_shards(database: str, path: str, root: Optional[str], mode: str, count: int,
+                exclude: List[str]) -> List[Tuple[str, str, str]]:
+    """Split a run into (shard database, shard key, path) triples.
+
+    Shards are keyed by the directory below `root` (defaults to `path`). If `path` is the
+    root, every top-level directory is processed into its shard in turn; otherwise `path`
+    must be below the root and goes to the shard of its top-level directory.
+    """
+    path = Path(path).absolute()
+    root = Path(root).absolute() if root else path
+
+    if path == root:
+        jobs = []
+        for el in sorted(root.iterdir()):
+            if el.is_dir() and not el.is_symlink() and not _is_excluded(el.name, exclude):
+                key = shard_key(el.name, mode, count)
+                jobs.append((shard_filename(database, key), key, str(el)))
+            elif el.is_file() and not _is_excluded(el.name, exclude):
+                logger.warning(f'Skipping {el}: files directly in the library root do not belong to any shard')
+        return jobs
+
+    try:
+        top_level = path.relative_to(root).parts[0]
+    except ValueError:
+        raise ValueError(f'{path} is not in the library root {root}')
+
+    key = shard_key(top_level, mode, count)
+    return [(shard_filename(database, key), key, str(path))]
+
+
+def _read_shard_info(filename: str) -> Optional[Dict[str, Any]]:
+    """Layout and key recorded by Sqlite.set_shard_info(), None if not a shard."""
+    try:
+        db = sqlite3.connect(Path(filename).absolute().as_uri() + '?mode=ro', uri=True)
+        try:
+            row = db.execute('SELECT mode, count, key FROM shard_info').fetchone()
+        finally:
+            db.close()
+    except sqlite3.Error:   # Not a database, or not written with --shard.
+        return None
+
+    return dict(zip(('mode', 'count', 'key'), row)) if row else None
+
+
+class Federation:
+    """Read-only view of all shards of a database.
+
+    The shards are attached to an in-memory database, which has temporary views "files",
+    "metadata", "tags" and "quarantine" with the rows of all shards, and the summary
+    tables added up. Views carry a "shard" column with the shard key; IDs are made unique
+    with SHARD_ID_FACTOR. Shards written by different versions may lack some columns of
+    "metadata"; these are NULL in the view. Only shards of the layout in the manifest are
+    attached, so that leftovers of another layout or backups are not counted twice.
+    """
+
+    def __init__(self, database: str):
+        layout = read_manifest(database)
+        if layout is None:
+            raise FileNotFoundError(f'{database} is not sharded: {manifest_filename(database)} not found')
+
+        self.shards = {}
+        for key, filename in find_shards(database).items():
+            if _read_shard_info(filename) == dict(layout, key=key):
+                self.shards[key] = filename
+            else:
+                logger.warning(f'Not attaching {filename}: not a shard of the layout {layout}')
+
+        if not self.shards:
+            raise FileNotFoundError(f'No shards of {database} found')
+        logger.info(f'Attaching {len(self.shards)} shards of {database}...')
+
+        self.db = sqlite3.connect(':memory:', uri=True)
+        limit = self._attach_limit(len(self.shards))
+        if len(self.shards) > limit:
+            raise ValueError(f'{len(self.shards)} shards exceed the limit of {limit} attached databases '
+                             f'of this SQLite build; use --shard hash with --shard_count {limit} or less')
+
+        for n, filename in enumerate(self.shards.values()):
+            # Read-only, so that runs writing to the shards are not blocked for longer than a query.
+            self.db.execute(f'ATTACH DATABASE ? AS s{n}', (Path(filename).absolute().as_uri() + '?mode=ro',))
+
+        self.create_views()
+
+    def _attach_limit(self, wanted: int) -> int:
+        if not hasattr(self.db, 'getlimit'):    # Python < 3.11: SQLite default.
+            return 10
+        # Capped by SQLite at the compile time maximum.
+        self.db.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, wanted)
+        return self.db.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+    def create_views(self):
+        self._create_view('files', ['id', 'path', 'processed'])
+        self._create_view('metadata', self._union_columns('metadata', [name for name, _ in METADATA_COLUMNS]))
+        self._create_view('tags', ['id', 'method', 'data'])
+        self._create_view('quarantine', ['path', 'stage', 'timeout', 'date_added'])
+
+        for table, keys in STATS_TABLES.items():
+            key_names = ', '.join(name for name, _ in keys)
+            parts = [f'SELECT {key_names}, files, bytes FROM s{n}.{table}' for n in self._having(table)]
+            if parts:
+                self.db.execute(f'''
+                    CREATE TEMP VIEW {table} AS
+                    SELECT {key_names}, sum(files) AS files, sum(bytes) AS bytes
+                    FROM ({' UNION ALL '.join(parts)})
+                    GROUP BY {key_names}
+                ''')
+
+    def _create_view(self, table: str, columns: List[str]):
+        parts = []
+        for n, key in enumerate(self.shards):
+            existing = self._columns(n, table)
+            if not existing:
+                continue
+
+            values = [f'id * {SHARD_ID_FACTOR} + {n} AS id' if c == 'id'
+                      else c if c in existing else f'NULL AS {c}'
+                      for c in columns]
+            key = key.replace("'", "''")
+            parts.append(f"SELECT {', '.join(values)}, '{key}' AS shard FROM s{n}.{table}")
+
+        if parts:
+            logger.debug(f'Creating view "{table}" over {len(parts)} shards...')
+            self.db.execute(f'CREATE TEMP VIEW {table} AS {" UNION ALL ".join(parts)}')
+
+    def _union_columns(self, table: str, columns: List[str]) -> List[str]:
+        """Known columns first, then those only some shards have (e.g. written by a newer version)."""
+        columns = list(columns)
+        for n in self._having(table):
+            columns += [c for c in self._columns(n, table) if c not in columns]
+        return columns
+
+    def _columns(self, n: int, table: str) -> List[str]:
+        return [r[1] for r in self.db.execute(f'PRAGMA s{n}.table_info({table})')]
+
+    def _having(self, table: str) -> List[int]:
+        return [n for n in range(len(self.shards)) if self._columns(n, table)]
+
+    def get_stats(self, table: str) -> List[tuple]:
+        if table not in STATS_TABLES:
+            raise ValueError(f'Unknown summary table: {table}')
+        return self.db.execute(f'SELECT * FROM {table} ORDER BY files DESC').fetchall()
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.db.execute(sql, parameters)
+
+    def close(self):
+        self.db.close()
@@ -1,24 +1,23 @@
 import logging
 import hashlib
-from typing import List
+from typing import List, Optional
 from pathlib import Path
 from datetime import datetime
 from fnmatch import fnmatch
 from .types import FileInfo
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 
 def walk_recurse(root: Path, exclude: List[str]):
     """Process files first and directories later."""
 
     dirs = []
-    if logger.level <= logging.DEBUG:
+    if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f'Scanning {root}...')
 
     contents = sorted(root.iterdir())
-    if logger.level <= logging.DEBUG:
+    if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f'{len(contents)} child elements found')
 
     for el in contents:
@@ -28,7 +27,7 @@ def walk_recurse(root: Path, exclude: List[str]):
             dirs.append(el)
 
     dirs = sorted(dirs)
-    if logger.level <= logging.DEBUG:
+    if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f'{len(dirs)} directories found')
 
     for d in dirs:
@@ -47,27 +46,44 @@ def _is_excluded(name: str, exclude: List[str]):
 
 
 class FileMetadata:
-    def __init__(self, path: Path, with_hash: bool):
+    # Bytes taken from each end of the file for the quick hash.
+    quick_hash_chunk = 2**16
+
+    def __init__(self, path: Path, with_hash: bool, with_quick_hash: bool = False):
         self.path = path
         self.with_hash = with_hash
+        self.with_quick_hash = with_quick_hash
 
-    def collect(self) -> FileInfo:
-        if logger.level <= logging.DEBUG:
+    def collect(self, data: Optional[bytes] = None) -> FileInfo:
+        """Hashes are computed from `data` (the whole file content read ahead) if given."""
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'Getting file system info for {self.path}...')
 
         stat = self.path.stat()
+        if data is not None and len(data) != stat.st_size:
+            logger.warning(f'File changed since it was read, reading again: {self.path}')
+            data = None
 
         if self.with_hash:
-            hash_hex = self.get_hash()
+            hash_hex = hashlib.sha1(data).hexdigest() if data is not None else self.get_hash()
         else:
             hash_hex = None
 
+        if self.with_quick_hash:
+            if data is not None:
+                quick_hash_hex = self.get_quick_hash_from(data)
+            else:
+                quick_hash_hex = self.get_quick_hash(stat.st_size)
+        else:
+            quick_hash_hex = None
+
         logger.debug('Done')
         return FileInfo(
             datetime.fromtimestamp(stat.st_ctime),
             datetime.fromtimestamp(stat.st_mtime),
             stat.st_size,
             hash_hex,
+            quick_hash_hex,
         )
 
     def get_hash(self) -> str:
@@ -84,3 +100,22 @@ class FileMetadata:
                 alg.update(data)
 
         return alg.hexdigest()
+
+    def get_quick_hash(self, size: int) -> str:
+        """SHA1 of the first and the last chunk; identifies content together with the size."""
+        logger.debug('Calculating quick hash...')
+        alg = hashlib.sha1()
+
+        with open(self.path, 'rb') as f:
+            alg.update(f.read(self.quick_hash_chunk))
+            if size > self.quick_hash_chunk:
+                f.seek(max(self.quick_hash_chunk, size - self.quick_hash_chunk))
+                alg.update(f.read(self.quick_hash_chunk))
+
+        return alg.hexdigest()
+
+    def get_quick_hash_from(self, data: bytes) -> str:
+        alg = hashlib.sha1(data[:self.quick_hash_chunk])
+        if len(data) > self.quick_hash_chunk:
+            alg.update(data[max(self.quick_hash_chunk, len(data) - self.quick_hash_chunk):])
+        return alg.hexdigest()
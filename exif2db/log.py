@@ -0,0 +1,110 @@
+import time
+import logging
+import logging.handlers
+from queue import SimpleQueue
+from typing import Dict, Tuple
+from .types import TimeLimit
+
+# Loggers of this package; __main__ is named so when run with `python -m exif2db`.
+PACKAGE_LOGGERS = ('exif2db', '__main__')
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class RepeatFilter(logging.Filter):
+    """Let through at most `burst` records per call site in each `interval_s` seconds.
+
+    The first record let through after a quiet period reports how many were dropped,
+    so a failure repeated for every file becomes one line per interval in the log.
+    """
+
+    def __init__(self, burst: int = 10, interval_s: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval_s = interval_s
+        # Call site -> [interval start, records in interval, suppressed records]
+        self.sites: Dict[Tuple[str, int, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        site = (record.pathname, record.lineno, record.levelno)
+        state = self.sites.get(site)
+        now = record.created
+
+        if state is None or now - state[0] > self.interval_s:
+            suppressed = state[2] if state else 0
+            self.sites[site] = [now, 1, 0]
+            if suppressed:
+                record.msg = f'{record.getMessage()} ({suppressed} similar messages suppressed)'
+                record.args = None
+            return True
+
+        state[1] += 1
+        if state[1] <= self.burst:
+            return True
+
+        state[2] += 1
+        return False
+
+    def suppressed(self) -> int:
+        return sum(state[2] for state in self.sites.values())
+
+
+class Logging:
+    """Logging to a file through a queue, so that the writing happens in a background thread."""
+
+    def __init__(self, filename: str, verbosity: int = 0, max_size_mb: float = 0, backups: int = 3):
+        if max_size_mb:
+            handler = logging.handlers.RotatingFileHandler(filename, maxBytes=int(max_size_mb * 2**20),
+                                                           backupCount=backups)
+        else:
+            handler = logging.FileHandler(filename, mode='w')
+        handler.setFormatter(logging.Formatter(FORMAT))
+
+        self.repeat_filter = RepeatFilter()
+        if verbosity == 0:     # -v asks for every file to be logged.
+            handler.addFilter(self.repeat_filter)
+
+        queue = SimpleQueue()
+        self.listener = logging.handlers.QueueListener(queue, handler)
+
+        root = logging.getLogger()
+        root.setLevel(logging.DEBUG if verbosity >= 2 else logging.INFO)
+        root.addHandler(logging.handlers.QueueHandler(queue))
+        for name in PACKAGE_LOGGERS:
+            # -v enables per-file tracing of this package, -vv of libraries too.
+            logging.getLogger(name).setLevel(logging.DEBUG if verbosity >= 1 else logging.INFO)
+
+        self.listener.start()
+
+    def stop(self):
+        suppressed = self.repeat_filter.suppressed()
+        if suppressed:
+            logging.getLogger(__name__).info(f'{suppressed} repeated messages were suppressed in total')
+        self.listener.stop()
+
+
+class ProgressLog:
+    """Per-file messages at DEBUG level, a summary line every `interval_s` seconds at INFO."""
+
+    def __init__(self, logger: logging.Logger, action: str, interval_s: float = 60.0):
+        self.logger = logger
+        self.action = action
+        self.strategy = TimeLimit(interval_s)
+        self.count = 0
+        self.start = self.last_time = time.monotonic()
+        self.last_count = 0
+
+    def update(self, path):
+        self.count += 1
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f'{self.action}: {path}')
+
+        if self.strategy.attempt():
+            now = time.monotonic()
+            rate = (self.count - self.last_count) / (now - self.last_time)
+            self.logger.info(f'{self.action}: {self.count} files ({rate:.1f}/s)')
+            self.last_count = self.count
+            self.last_time = now
+
+    def finish(self):
+        rate = self.count / max(time.monotonic() - self.start, 1e-9)
+        self.logger.info(f'{self.action}: {self.count} files in total ({rate:.1f}/s)')
@@ -10,10 +10,13 @@ logger = logging.getLogger(__name__)
 class ExifReader_Combined(ExifReader):
     def load(self) -> ExifData:
         for method in [ExifReader_Pillow, ExifReader_Exiftool]:
-            er = method(self.path)
+            er = method(self.path, self.data)
             self._method = er.method
+            self._version = er.version
             try:
-                return er.load()
+                exif = er.load()
+                self.tags = er.tags
+                return exif
             except Exception as e:
                 if method is ExifReader_Exiftool:
                     raise ExifError from e
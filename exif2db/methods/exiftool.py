@@ -1,55 +1,87 @@
 import logging
-from exiftool import ExifToolHelper
+from typing import TYPE_CHECKING
 from ..types import ExifData, ExifReader, Method, DEFAULT_EXIF_DATA
 from ..utils import parse_exif_date
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+
+if TYPE_CHECKING:
+    from exiftool import ExifToolHelper
 
 
 # noinspection PyPep8Naming
 class ExifReader_Exiftool(ExifReader):
     method = Method.Exiftool
+    version = 1
     tags = []
-    process: ExifToolHelper = None
+    process: 'ExifToolHelper' = None
 
     @classmethod
     def initialize(cls):
+        """Create the process wrapper; the Perl process itself is spawned on the first request."""
+        from exiftool import ExifToolHelper
+
         logger.debug('Launching process...')
         cls.process = ExifToolHelper()
 
     @classmethod
     def shutdown(cls):
+        if cls.process is None:
+            return
+
         logger.debug('Stopping process...')
         cls.process.terminate()
+        cls.process = None
+
+    # noinspection PyBroadException
+    @classmethod
+    def abort(cls):
+        """Kill a process left in an unknown state, e.g. after a timeout. The next load() spawns a new one."""
+        if cls.process is None:
+            return
+
+        logger.warning('Killing exiftool process...')
+        try:
+            cls.process.terminate(timeout=1)
+        except Exception:
+            logger.exception('Error killing exiftool process')
+        cls.process = None
 
     def load(self) -> ExifData:
+        if self.process is None:
+            self.initialize()
+
         et = self.process   # Brevity only
 
-        if logger.level <= logging.DEBUG:
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'Getting EXIF data from {self.path}...')
 
         for metadata_dict in et.get_metadata(self.path):
             logger.debug('Got EXIF data')
+            self.tags = metadata_dict
+            return self.from_tags(metadata_dict)
 
-            # See https://exiftool.org/TagNames/EXIF.html
-            mime_type, mime_subtype = metadata_dict.get('File:MIMEType').split('/')
-            if mime_type == 'image':
-                return self._from_image(metadata_dict)
-            elif mime_type == 'video':
-                if mime_subtype == 'quicktime':
-                    return self._from_video_quicktime(metadata_dict)
-                elif mime_subtype == 'm2ts':
-                    return self._from_video_m2ts(metadata_dict)
-                elif mime_subtype == 'mp4':
-                    return self._from_video_mp4(metadata_dict)
-                elif mime_subtype == 'mpeg':
-                    return self._from_video_mpg(metadata_dict)
-                elif mime_subtype == 'x-msvideo':
-                    return self._from_video_avi(metadata_dict)
-        else:
-            logger.debug(f'Unsupported MIME type for {self.path}')
+        return DEFAULT_EXIF_DATA
 
+    @classmethod
+    def from_tags(cls, tags: dict) -> ExifData:
+        # See https://exiftool.org/TagNames/EXIF.html
+        mime_type, mime_subtype = tags.get('File:MIMEType').split('/')
+        if mime_type == 'image':
+            return cls._from_image(tags)
+        elif mime_type == 'video':
+            if mime_subtype == 'quicktime':
+                return cls._from_video_quicktime(tags)
+            elif mime_subtype == 'm2ts':
+                return cls._from_video_m2ts(tags)
+            elif mime_subtype == 'mp4':
+                return cls._from_video_mp4(tags)
+            elif mime_subtype == 'mpeg':
+                return cls._from_video_mpg(tags)
+            elif mime_subtype == 'x-msvideo':
+                return cls._from_video_avi(tags)
+
+        logger.debug(f'Unsupported MIME type {mime_type}/{mime_subtype}')
         return DEFAULT_EXIF_DATA
 
     @staticmethod
@@ -1,80 +1,142 @@
+import base64
 import logging
+from io import BytesIO
 from typing import Optional
 from PIL import Image
 from PIL.ExifTags import Base, GPS, IFD
 from PIL.TiffImagePlugin import IFDRational
-from pi_heif import register_heif_opener
-import pillow_avif
 from ..types import ExifData, ExifReader, Method, DEFAULT_EXIF_DATA
 from ..utils import dms2dd, parse_exif_date
 
-register_heif_opener()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+
+
+def _register_heif():
+    from pi_heif import register_heif_opener
+    register_heif_opener()
+
+
+def _register_avif():
+    # noinspection PyUnresolvedReferences
+    import pillow_avif     # Registers the plugin on import.
+
+
+# Format plugins are loaded on the first file that needs them.
+_PLUGINS = {
+    '.heic': _register_heif,
+    '.heif': _register_heif,
+    '.avif': _register_avif,
+}
+_registered = set()
+
+
+def _ensure_plugin(file_ext: str):
+    register = _PLUGINS.get(file_ext.lower())
+    if register is not None and register not in _registered:
+        logger.debug(f'Registering Pillow plugin for {file_ext}')
+        register()
+        _registered.add(register)
+
+
+def _to_json(value):
+    if isinstance(value, IFDRational):
+        return float(value)
+    if isinstance(value, (tuple, list)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, (str, int, float)) or value is None:
+        return value
+    return str(value)
+
+
+def _ifd_to_json(ifd) -> dict:
+    # JSON object keys are strings, hence the numeric tag IDs are converted.
+    return {str(int(tag)): _to_json(value) for tag, value in ifd.items()}
+
+
+def _ifd_from_json(ifd: Optional[dict]) -> dict:
+    return {int(tag): value for tag, value in ifd.items()} if ifd else {}
 
 
 # noinspection PyPep8Naming
 class ExifReader_Pillow(ExifReader):
     method = Method.Pillow
+    version = 1
 
     def load(self) -> ExifData:
         # noinspection PyBroadException
         try:
-            if logger.level <= logging.DEBUG:
+            if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f'Opening {self.path}...')
 
-            img = Image.open(self.path)
+            _ensure_plugin(self.path.suffix)
+            img = Image.open(BytesIO(self.data) if self.data is not None else self.path)
             logger.debug('Getting EXIF data...')
 
             exif = img.getexif()
-
+            self.tags = {
+                'format': img.format,
+                'IFD0': _ifd_to_json(exif),
+            }
             if exif:
                 logger.debug('Got EXIF data')
-                exif_exif = exif.get_ifd(IFD.Exif)
-                exif_gps = exif.get_ifd(IFD.GPSInfo)
-
-                date_time = exif.get(Base.DateTime)
-                date_time_original = exif_exif.get(Base.DateTimeOriginal)
-                date_time_digitized = exif_exif.get(Base.DateTimeDigitized)
-                date_time_sub_sec = exif.get(Base.SubsecTime)
-                date_time_original_sub_sec = exif_exif.get(Base.SubsecTimeOriginal)
-                date_time_digitized_sub_sec = exif_exif.get(Base.SubsecTimeDigitized)
-
-                lat = exif_gps.get(GPS.GPSLatitude)
-                long = exif_gps.get(GPS.GPSLongitude)
-                alt = exif_gps.get(GPS.GPSAltitude)
-
-                return ExifData(
-                    'image/' + img.format.lower(),
-                    exif.get(Base.Make),
-                    exif.get(Base.Model),
-                    parse_exif_date(date_time, date_time_sub_sec),
-                    parse_exif_date(date_time_original, date_time_original_sub_sec),
-                    parse_exif_date(date_time_digitized, date_time_digitized_sub_sec),
-                    None,
-                    exif.get(Base.Software),
-                    self._parse_coordinate(lat, exif_gps.get(GPS.GPSLatitudeRef)),
-                    self._parse_coordinate(long, exif_gps.get(GPS.GPSLongitudeRef)),
-                    float(alt) if alt else None,
-                    exif_exif.get(Base.ExifImageWidth),
-                    exif_exif.get(Base.ExifImageHeight),
-                )
+                for ifd in (IFD.Exif, IFD.GPSInfo):
+                    self.tags[ifd.name] = _ifd_to_json(exif.get_ifd(ifd))
             else:
                 logger.debug('EXIF data was not found')
-                return DEFAULT_EXIF_DATA
-        except Exception:
-            logger.exception(f'Pillow error for {self.path}')
+
+            return self.from_tags(self.tags)
+        except Exception as e:
+            # Tracebacks only with -v, failures are common on large libraries.
+            logger.warning(f'Pillow error for {self.path}: {e!r}', exc_info=logger.isEnabledFor(logging.DEBUG))
             raise
 
+    @classmethod
+    def from_tags(cls, tags: dict) -> ExifData:
+        exif = _ifd_from_json(tags.get('IFD0'))
+        if not exif:
+            return DEFAULT_EXIF_DATA
+
+        exif_exif = _ifd_from_json(tags.get(IFD.Exif.name))
+        exif_gps = _ifd_from_json(tags.get(IFD.GPSInfo.name))
+
+        date_time = exif.get(Base.DateTime)
+        date_time_original = exif_exif.get(Base.DateTimeOriginal)
+        date_time_digitized = exif_exif.get(Base.DateTimeDigitized)
+        date_time_sub_sec = exif.get(Base.SubsecTime)
+        date_time_original_sub_sec = exif_exif.get(Base.SubsecTimeOriginal)
+        date_time_digitized_sub_sec = exif_exif.get(Base.SubsecTimeDigitized)
+
+        lat = exif_gps.get(GPS.GPSLatitude)
+        long = exif_gps.get(GPS.GPSLongitude)
+        alt = exif_gps.get(GPS.GPSAltitude)
+
+        return ExifData(
+            'image/' + tags['format'].lower(),
+            exif.get(Base.Make),
+            exif.get(Base.Model),
+            parse_exif_date(date_time, date_time_sub_sec),
+            parse_exif_date(date_time_original, date_time_original_sub_sec),
+            parse_exif_date(date_time_digitized, date_time_digitized_sub_sec),
+            None,
+            exif.get(Base.Software),
+            cls._parse_coordinate(lat, exif_gps.get(GPS.GPSLatitudeRef)),
+            cls._parse_coordinate(long, exif_gps.get(GPS.GPSLongitudeRef)),
+            float(alt) if alt else None,
+            exif_exif.get(Base.ExifImageWidth),
+            exif_exif.get(Base.ExifImageHeight),
+        )
+
     @staticmethod
     def _parse_coordinate(c, ref: str) -> Optional[float]:
         if c is None or ref is None:
             return None
 
-        if type(c) is tuple:
+        if type(c) in (tuple, list):
             return dms2dd(c[0], c[1], c[2], ref)
 
-        if type(c) is IFDRational:
+        if type(c) in (IFDRational, float):
             res = float(c)
             if ref in ('S', 'W'):
                 res = -res
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'exif2db_'
+# Name -> (type, help). Rates and ETA are derived on export from the counters.
+METRICS = {
+    'files_scanned_total': ('counter', 'Files added to the database by the directory scan.'),
+    'files_processed_total': ('counter', 'Files whose metadata was collected.'),
+    'files_scanned_per_second': ('gauge', 'Scan rate since the previous export.'),
+    'files_processed_per_second': ('gauge', 'Processing rate since the previous export.'),
+    'files_pending': ('gauge', 'Files left to process in the current run.'),
+    'prefetch_queue_depth': ('gauge', 'Files being read ahead.'),
+    'eta_seconds': ('gauge', 'Estimated time to process the pending files at the current rate.'),
+    'bytes_hashed_total': ('counter', 'Bytes of file content hashed.'),
+    'extractions_total': ('counter', 'Metadata extractions by reader method and result.'),
+    'commit_duration_seconds': ('summary', 'Time spent committing to the database.'),
+    'last_export_timestamp_seconds': ('gauge', 'Unix time of the last export.'),
+}
+
+
+class Metrics:
+    """Counters of a run, exported in Prometheus text format to a file and/or over HTTP.
+
+    Does nothing but counting until configure() is called. Rates and the ETA are then
+    updated, and the file written, by a background thread, so that they keep moving
+    while a file or a phase of the run takes long.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {name: {} for name in METRICS}
+        self.lock = threading.Lock()
+        self.textfile: Optional[str] = None
+        self.server = None
+        self.exporter: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.rate_base: Dict[str, float] = {}
+        self.rate_time = time.monotonic()
+
+    def configure(self, textfile: Optional[str], port: Optional[int], interval_s: float = 15.0,
+                  address: str = '127.0.0.1'):
+        self.textfile = textfile
+        if port:
+            # Imported here: http.server pulls in ssl, email and http.client, too much for every startup.
+            from http.server import ThreadingHTTPServer
+            self.server = ThreadingHTTPServer((address, port), _handler(self))
+            threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+            logger.info(f'Serving metrics on {address}:{port}')
+
+        self.exporter = threading.Thread(target=self._export_loop, args=(interval_s,), name='metrics-export',
+                                         daemon=True)
+        self.exporter.start()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    @contextmanager
+    def time_commit(self):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inc('commit_duration_seconds', time.monotonic() - start, quantity='sum')
+            self.inc('commit_duration_seconds', 1, quantity='count')
+
+    # noinspection PyBroadException
+    def _export_loop(self, interval_s: float):
+        while not self.stopping.wait(interval_s):
+            try:
+                self.export()
+            except Exception:   # E.g. the file system is full; the next interval may do better.
+                logger.exception('Error exporting metrics')
+
+    def export(self):
+        self._update_rates()
+        if self.textfile:
+            # Written aside and renamed, so that a collector never reads a partial file.
+            tmp = self.textfile + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp, self.textfile)
+
+    def close(self):
+        if self.exporter is not None:
+            self.stopping.set()
+            self.exporter.join()
+            self.export()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _update_rates(self):
+        now = time.monotonic()
+        elapsed = max(now - self.rate_time, 1e-9)
+        rates = {}
+        for name in ('files_scanned', 'files_processed'):
+            total = self.values[name + '_total'].get((), 0)
+            rates[name] = (total - self.rate_base.get(name, 0)) / elapsed
+            self.rate_base[name] = total
+            self.set(name + '_per_second', rates[name])
+        self.rate_time = now
+
+        pending = self.values['files_pending'].get(())
+        if pending is not None:
+            if not pending:
+                eta = 0.0
+            elif rates['files_processed'] > 0:
+                eta = pending / rates['files_processed']
+            else:   # Stalled.
+                eta = float('inf')
+            self.set('eta_seconds', eta)
+        self.set('last_export_timestamp_seconds', time.time())
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (type_, help_) in METRICS.items():
+                series = self.values[name]
+                if not series:
+                    continue
+
+                lines.append(f'# HELP {PREFIX}{name} {help_}')
+                lines.append(f'# TYPE {PREFIX}{name} {type_}')
+                for key, value in sorted(series.items()):
+                    labels = dict(key)
+                    suffix = '_' + labels.pop('quantity') if type_ == 'summary' else ''
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f'{PREFIX}{name}{suffix}{"{" + label_text + "}" if label_text else ""} '
+                                 f'{_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _handler(m: Metrics):
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = m.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+metrics = Metrics()
@@ -0,0 +1,193 @@
+import os
+import struct
+import logging
+import threading
+from itertools import islice
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Iterable, Iterator, List, Tuple, Optional, Dict
+from .metrics import metrics
+from .log import ProgressLog
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+IO_ORDERS = ('id', 'inode', 'extent')
+
+# Whole files up to this size are read into memory when the content is needed anyway (hashing).
+MAX_BUFFER_SIZE = 2**26
+# Readers only look at the container headers: the start of the file and, for some
+# video containers (e.g. MP4 with the "moov" atom at the end), its tail.
+READER_RANGE = 2**18
+
+# Lookups of the physical location in flight when ordering.
+SCHEDULE_THREADS = 4
+UNKNOWN_LOCATION = (-1, 0, 0)
+
+_FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER = '=QQLLLL'      # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+_FIEMAP_EXTENT_SIZE = 56        # fe_logical, fe_physical, fe_length, fe_reserved64[2], fe_flags, fe_reserved[3]
+
+
+def schedule(rows: Iterable[Tuple[int, str]], order: str,
+             timeout: Optional[float] = None) -> Iterable[Tuple[int, str]]:
+    """Order pending files by their physical location to reduce seeking on spinning disks.
+
+    'id' keeps the scan order, 'inode' sorts by device and inode number, 'extent' sorts by
+    device and the physical offset of the first extent (FIEMAP), falling back to the inode.
+    Locations are looked up in background threads, and a file whose lookup fails or takes
+    longer than `timeout` seconds is put first, to be handled (and quarantined) by processing.
+    """
+    if order == 'id':
+        return rows
+
+    logger.info(f'Ordering files by {order}...')
+    progress = ProgressLog(logger, 'Located')
+    keyed = []
+    pool = ThreadPoolExecutor(max_workers=SCHEDULE_THREADS, thread_name_prefix='schedule')
+    try:
+        rows = iter(rows)
+        pending = deque((file_id, path, pool.submit(_physical_key, path, order))
+                        for file_id, path in islice(rows, SCHEDULE_THREADS * 4))
+        while pending:
+            file_id, path, future = pending.popleft()
+            row = next(rows, None)
+            if row is not None:
+                pending.append((row[0], row[1], pool.submit(_physical_key, row[1], order)))
+
+            # noinspection PyBroadException
+            try:
+                key = future.result(timeout=timeout)
+            except TimeoutError:
+                logger.warning(f'Locating took longer than {timeout}s, giving up: {path}')
+                key = UNKNOWN_LOCATION
+            except Exception:
+                logger.warning(f'Error locating {path}', exc_info=logger.isEnabledFor(logging.DEBUG))
+                key = UNKNOWN_LOCATION
+            keyed.append((key, file_id, path))
+            progress.update(path)
+    finally:
+        # Not waiting for lookups that hang.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    progress.finish()
+    keyed.sort()
+    return [(file_id, path) for _, file_id, path in keyed]
+
+
+def _physical_key(path: str, order: str) -> Tuple[int, int, int]:
+    """(device, 0, physical offset) or (device, 1, inode): offsets and inodes are not comparable."""
+    try:
+        stat = os.stat(path)
+    except OSError:     # E.g. file was deleted since scan; processing will handle it.
+        return UNKNOWN_LOCATION
+
+    if order == 'extent':
+        offset = _first_extent_offset(path)
+        if offset is not None:
+            return stat.st_dev, 0, offset
+
+    return stat.st_dev, 1, stat.st_ino
+
+
+def _first_extent_offset(path: str) -> Optional[int]:
+    if fcntl is None:
+        return None
+
+    request = bytearray(struct.pack(_FIEMAP_HEADER, 0, 2**64 - 1, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT_SIZE))
+    try:
+        with open(path, 'rb') as f:
+            fcntl.ioctl(f.fileno(), _FS_IOC_FIEMAP, request, True)
+    except OSError:     # File system does not support FIEMAP.
+        return None
+
+    mapped_extents = struct.unpack_from('=L', request, 20)[0]
+    if not mapped_extents:
+        return None
+
+    return struct.unpack_from('=Q', request, struct.calcsize(_FIEMAP_HEADER) + 8)[0]
+
+
+def prefetch(rows: Iterable[Tuple[int, str]], window: int, per_device: int, read_whole: bool,
+             timeout: Optional[float] = None) -> Iterator[Tuple[int, str, Optional[bytes]]]:
+    """Yield rows in order together with the file content read ahead in background threads.
+
+    Up to `window` files are in flight, with at most `per_device` of them being read from
+    the same device at a time. Content is only loaded when `read_whole` is set (the whole
+    file is needed for hashing) and the file is not too large; otherwise the kernel is
+    advised to read ahead the ranges the readers need and None is yielded. None is also
+    yielded for a file not read within `timeout` seconds, so that a hung read is left to
+    the consumer and its time limit.
+    """
+    if window <= 0:
+        for file_id, path in rows:
+            yield file_id, path, None
+        return
+
+    limits: Dict[int, threading.Semaphore] = defaultdict(lambda: threading.Semaphore(per_device))
+    limits_lock = threading.Lock()
+
+    def device_limit(device: int) -> threading.Semaphore:
+        with limits_lock:
+            return limits[device]
+
+    def load(path: str) -> Optional[bytes]:
+        try:
+            device = os.stat(path).st_dev
+        except OSError:
+            return None
+
+        with device_limit(device):
+            return _read(path, read_whole)
+
+    pool = ThreadPoolExecutor(max_workers=window, thread_name_prefix='prefetch')
+    try:
+        rows = iter(rows)
+        pending = deque((file_id, path, pool.submit(load, path)) for file_id, path in islice(rows, window))
+
+        while pending:
+            file_id, path, future = pending.popleft()
+            row = next(rows, None)
+            if row is not None:
+                pending.append((row[0], row[1], pool.submit(load, row[1])))
+            metrics.set('prefetch_queue_depth', len(pending))
+
+            # noinspection PyBroadException
+            try:
+                data = future.result(timeout=timeout)
+            except TimeoutError:
+                logger.warning(f'Reading ahead took longer than {timeout}s, giving up: {path}')
+                data = None
+            except Exception:   # Reading will be retried (and fail properly) by the consumer.
+                data = None
+            yield file_id, path, data
+    finally:
+        # Not waiting for reads that hang.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _read(path: str, read_whole: bool) -> Optional[bytes]:
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if read_whole and size <= MAX_BUFFER_SIZE:
+            _advise(f.fileno(), [(0, 0)], 'POSIX_FADV_SEQUENTIAL')
+            return f.read()
+
+        ranges = [(0, READER_RANGE)]
+        if size > 2 * READER_RANGE:
+            ranges.append((size - READER_RANGE, READER_RANGE))
+        _advise(f.fileno(), ranges, 'POSIX_FADV_WILLNEED')
+        return None
+
+
+def _advise(fd: int, ranges: List[Tuple[int, int]], advice: str):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    for offset, length in ranges:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
@@ -1,18 +1,87 @@
+import json
+import time
+import zlib
 import logging
 import sqlite3
 import dataclasses
+from typing import List, Tuple, Dict, Set, Optional, get_args
 from pathlib import Path
-from .types import Db
+from datetime import datetime
+from .types import Db, TimeLimit
 from .types import FileInfo, ExifData
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+
+
+def _column_type(annotation) -> str:
+    args = [a for a in get_args(annotation) if a is not type(None)]
+    annotation = args[0] if args else annotation
+    if annotation is int:
+        return 'INTEGER'
+    elif annotation is float:
+        return 'REAL'
+    else:
+        return 'TEXT'
+
+
+def _columns(cls) -> List[Tuple[str, str]]:
+    return [(f.name, _column_type(f.type)) for f in dataclasses.fields(cls)]
+
+
+def _exif_data_from_row(row: tuple) -> ExifData:
+    values = []
+    for f, value in zip(dataclasses.fields(ExifData), row):
+        if isinstance(value, str) and datetime in get_args(f.type):
+            value = datetime.fromisoformat(value)
+        values.append(value)
+    return ExifData(*values)
+
+
+def _guess_mime_type(path: str) -> Optional[str]:
+    import mimetypes    # Only needed for --reextract --mime.
+    return mimetypes.guess_type(path)[0]
+
+
+# Derived from the dataclasses, so that a field added to ExifData becomes a column
+# of existing databases too (see sync_metadata_columns).
+FILE_INFO_COLUMNS = _columns(FileInfo)
+EXIF_DATA_COLUMNS = _columns(ExifData)
+METADATA_COLUMNS = ([('id', 'INTEGER'), ('method', 'TEXT'), ('method_version', 'INTEGER')]
+                    + FILE_INFO_COLUMNS + EXIF_DATA_COLUMNS)
+
+
+# Summary tables maintained by triggers on "metadata": table -> key columns and their
+# expressions over a metadata row, referred to as {r}.
+_DATE = 'coalesce({r}.date_time_original, {r}.date_time, {r}.file_date_modified)'
+STATS_TABLES = {
+    'stats_model': [('make', "coalesce({r}.make, '')"),
+                    ('model', "coalesce({r}.model, '')")],
+    'stats_month': [('year', f"coalesce(substr({_DATE}, 1, 4), '')"),
+                    ('month', f"coalesce(substr({_DATE}, 6, 2), '')")],
+    'stats_mime': [('mime_type', "coalesce({r}.mime_type, '')")],
+    # Parent directory of the file, including the trailing separator.
+    'stats_folder': [('folder', "coalesce((SELECT rtrim(path, replace(path, '/', '')) FROM files "
+                                "WHERE id = {r}.id), '')")],
+}
 
 
 class Sqlite(Db):
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, staging: Optional[str] = None, checkpoint_s: float = 300.0):
+        """With `staging` (':memory:' or a file on tmpfs), all work is done on a copy of the
+        database, which is written back to `filename` by checkpoint() every `checkpoint_s`
+        seconds of commits and on close(). A crash loses at most one checkpoint interval;
+        the "processed" flag in the on-disk copy tells what has to be redone."""
         logger.info(f'Initializing database from {filename}...')
-        self.db = sqlite3.connect(filename)
+        self.staging = staging
+        if staging:
+            logger.info(f'Staging database in {staging}...')
+            self.disk = sqlite3.connect(filename)
+            self.db = sqlite3.connect(staging)
+            self.disk.backup(self.db)
+            self.checkpoint_strategy = TimeLimit(checkpoint_s)
+        else:
+            self.disk = None
+            self.db = sqlite3.connect(filename)
 
         if self.is_table_exists('files'):
             logger.debug('Table "files" exists. Getting max ID...')
@@ -25,11 +94,23 @@ class Sqlite(Db):
 
         if self.is_table_exists('metadata'):
             logger.debug('Table "metadata" exists')
+            self.sync_metadata_columns()
         else:
             logger.debug('Table "metadata" does not exist')
             self.init_metadata()
 
+        if not self.is_table_exists('tags'):
+            logger.debug('Table "tags" does not exist')
+            self.init_tags()
+
+        if not self.is_table_exists('quarantine'):
+            logger.debug('Table "quarantine" does not exist')
+            self.init_quarantine()
+
+        self.init_stats()
+
         self.cur = self.db.cursor()
+        self.scanning = False
         logger.debug('Created Sqlite instance')
 
     def init_files(self):
@@ -44,32 +125,12 @@ class Sqlite(Db):
     def reset_files_data(self):
         self.drop_files()
         self.init_files()
+        self.init_stats()   # Triggers of "files" are dropped with it.
 
     def init_metadata(self):
         logger.debug('Creating "metadata" table...')
-        self.db.execute('''
-            CREATE TABLE IF NOT EXISTS metadata (
-                id INTEGER,
-                method TEXT,
-                file_date_created TEXT,
-                file_date_modified TEXT,
-                size INTEGER,
-                hash TEXT,
-                mime_type TEXT,
-                make TEXT,
-                model TEXT,
-                date_time TEXT,
-                date_time_original TEXT,
-                date_time_digitized TEXT,
-                duration REAL,
-                software TEXT,
-                gps_lat REAL,
-                gps_long REAL,
-                gps_alt REAL,
-                width INTEGER,
-                height INTEGER
-            )
-        ''')
+        columns = ',\n'.join(f'{name} {type_}' for name, type_ in METADATA_COLUMNS)
+        self.db.execute(f'CREATE TABLE IF NOT EXISTS metadata ({columns})')
         self.file_num = 0
 
     def drop_metadata(self):
@@ -79,49 +140,321 @@ class Sqlite(Db):
     def reset_exif_data(self):
         self.drop_metadata()
         self.init_metadata()
+        self.drop_tags()
+        self.init_tags()
+        self.drop_stats()
+        self.init_stats()
+
+    def init_stats(self):
+        """Create summary tables with triggers keeping them in line with "metadata"."""
+        created = False
+        for table, keys in STATS_TABLES.items():
+            if self.is_table_exists(table):
+                continue
+
+            logger.debug(f'Creating "{table}" table...')
+            key_names = ', '.join(name for name, _ in keys)
+            self.db.execute(f'CREATE TABLE {table} ({key_names}, files INTEGER, bytes INTEGER, '
+                            f'PRIMARY KEY ({key_names}))')
+            created = True
+
+        self.db.executescript(f'''
+            CREATE TRIGGER IF NOT EXISTS metadata_stats_insert AFTER INSERT ON metadata BEGIN
+                {self._stats_delta('NEW', 1)}
+            END;
+            CREATE TRIGGER IF NOT EXISTS metadata_stats_delete AFTER DELETE ON metadata BEGIN
+                {self._stats_delta('OLD', -1)}
+            END;
+            CREATE TRIGGER IF NOT EXISTS metadata_stats_update AFTER UPDATE ON metadata BEGIN
+                {self._stats_delta('OLD', -1)}
+                {self._stats_delta('NEW', 1)}
+            END;
+            -- Before, so that the folder of the file can still be looked up.
+            CREATE TRIGGER IF NOT EXISTS files_delete_metadata BEFORE DELETE ON files BEGIN
+                DELETE FROM metadata WHERE id = OLD.id;
+                DELETE FROM tags WHERE id = OLD.id;
+            END;
+        ''')
+
+        if created:
+            self.rebuild_stats()
+
+    @staticmethod
+    def _stats_delta(row: str, delta: int) -> str:
+        statements = []
+        for table, keys in STATS_TABLES.items():
+            key_names = ', '.join(name for name, _ in keys)
+            key_values = ', '.join(expr.format(r=row) for _, expr in keys)
+            statements.append(f'''
+                INSERT INTO {table} ({key_names}, files, bytes)
+                VALUES ({key_values}, {delta}, {delta} * coalesce({row}.size, 0))
+                ON CONFLICT ({key_names}) DO UPDATE SET files = files + excluded.files,
+                                                        bytes = bytes + excluded.bytes;''')
+            if delta < 0:
+                statements.append(f'DELETE FROM {table} WHERE files <= 0;')
+        return '\n'.join(statements)
+
+    def rebuild_stats(self):
+        """Recompute summary tables from scratch, e.g. for a database created by an older version."""
+        logger.info('Building summary tables...')
+        for table, keys in STATS_TABLES.items():
+            key_names = ', '.join(name for name, _ in keys)
+            key_values = ', '.join(expr.format(r='m') for _, expr in keys)
+            self.db.execute(f'DELETE FROM {table}')
+            self.db.execute(f'''
+                INSERT INTO {table} ({key_names}, files, bytes)
+                SELECT {key_values}, count(*), sum(coalesce(m.size, 0))
+                FROM metadata m
+                GROUP BY {', '.join(str(i + 1) for i in range(len(keys)))}
+            ''')
+        self.db.commit()
+
+    def drop_stats(self):
+        for table in STATS_TABLES:
+            logger.debug(f'Dropping "{table}" table...')
+            self.db.execute(f'DROP TABLE IF EXISTS {table}')
+
+    def get_stats(self, table: str) -> List[tuple]:
+        if table not in STATS_TABLES:
+            raise ValueError(f'Unknown summary table: {table}')
+        return self.db.execute(f'SELECT * FROM {table} ORDER BY files DESC').fetchall()
+
+    def sync_metadata_columns(self):
+        """Add columns for FileInfo/ExifData fields that appeared after the table was created."""
+        existing = {r[1] for r in self.db.execute('PRAGMA table_info(metadata)')}
+        for name, type_ in METADATA_COLUMNS:
+            if name not in existing:
+                logger.info(f'Adding column "{name}" to "metadata" table...')
+                self.db.execute(f'ALTER TABLE metadata ADD COLUMN {name} {type_}')
+
+    def init_tags(self):
+        logger.debug('Creating "tags" table...')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, method TEXT, data BLOB)')
+
+    def drop_tags(self):
+        logger.debug('Dropping "tags" table...')
+        self.db.execute('DROP TABLE IF EXISTS tags')
+
+    def init_quarantine(self):
+        # Kept by path rather than ID: it survives --purge and applies to files added by later scans.
+        logger.debug('Creating "quarantine" table...')
+        self.db.execute('CREATE TABLE IF NOT EXISTS quarantine '
+                        '(path TEXT PRIMARY KEY, stage TEXT, timeout REAL, date_added TEXT)')
+
+    def add_file(self, path: Path) -> bool:
+        """Returns False if the path is in the database already, e.g. on a rescan."""
+        path = str(path)
+        if self.scanning:
+            self.cur.execute('INSERT OR IGNORE INTO temp.scan VALUES (?)', (path,))
+        if self.cur.execute('SELECT 1 FROM files WHERE path = ?', (path,)).fetchone():
+            return False
 
-    def add_file(self, path: Path):
         self.file_num += 1
-        self.add_file_raw(self.file_num, str(path), 0)
+        self.add_file_raw(self.file_num, path, 0)
+        return True
 
     def add_file_raw(self, id_: int, path: str, processed: int):
-        if logger.level <= logging.DEBUG:
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'Adding {path}...')
 
         self.cur.execute('INSERT INTO files VALUES (?, ?, ?)', (id_, path, processed))
 
-    def add_metadata(self, file_id: int, fi: FileInfo, exif: ExifData, method: str):
-        self.add_metadata_raw((file_id, method) + dataclasses.astuple(fi) + dataclasses.astuple(exif))
+    def init_path_index(self):
+        """Index for add_file() to recognize known paths; only created when scanning."""
+        logger.debug('Creating path index on "files"...')
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_path ON files (path)')
+
+    def start_scan(self):
+        """Start recording the paths passed to add_file(), see end_scan()."""
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS scan (path TEXT PRIMARY KEY)')
+        self.db.execute('DELETE FROM temp.scan')
+        self.scanning = True
+
+    def end_scan(self, prefix: str) -> List[Tuple[int, str]]:
+        """Files under the prefix that were not seen by the scan, e.g. deleted from the library."""
+        rows = self.db.execute('''
+            SELECT id, path FROM files
+            WHERE path LIKE ? AND path NOT IN (SELECT path FROM temp.scan)
+        ''', (prefix + '%',)).fetchall()
+        self.db.execute('DROP TABLE temp.scan')
+        self.scanning = False
+        return rows
+
+    def delete_file(self, file_id: int):
+        # Metadata and tags go with it, and summary tables are corrected, by triggers.
+        self.cur.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def add_metadata(self, file_id: int, fi: FileInfo, exif: ExifData, method: str, version: int):
+        self.add_metadata_raw((file_id, method, version) + dataclasses.astuple(fi) + dataclasses.astuple(exif),
+                              [name for name, _ in METADATA_COLUMNS])
         self.set_file_processed(file_id)
 
-    def add_metadata_raw(self, row: tuple):
-        if logger.level <= logging.DEBUG:
+    def add_metadata_raw(self, row: tuple, columns: List[str]):
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'Adding metadata for file ID {row[0]}...')
 
-        self.cur.execute('INSERT INTO metadata VALUES '
-                         '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                         row)
+        names = ', '.join(columns)
+        placeholders = ', '.join('?' * len(row))
+        self.cur.execute(f'INSERT INTO metadata ({names}) VALUES ({placeholders})', row)
+
+    def update_metadata(self, file_id: int, fi: FileInfo, exif: ExifData, method: str, version: int):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Updating metadata for file ID {file_id}...')
+
+        assignments = ', '.join(f'{name} = ?' for name, _ in METADATA_COLUMNS[1:])
+        self.cur.execute(f'UPDATE metadata SET {assignments} WHERE id = ?',
+                         (method, version) + dataclasses.astuple(fi) + dataclasses.astuple(exif) + (file_id,))
+
+    def update_exif_data(self, file_id: int, exif: ExifData, version: int):
+        assignments = ', '.join(f'{name} = ?' for name, _ in EXIF_DATA_COLUMNS)
+        self.cur.execute(f'UPDATE metadata SET {assignments}, method_version = ? WHERE id = ?',
+                         dataclasses.astuple(exif) + (version, file_id))
+
+    def add_tags(self, file_id: int, method: str, tags: dict):
+        data = zlib.compress(json.dumps(tags, separators=(',', ':'), default=str).encode())
+        self.cur.execute('INSERT OR REPLACE INTO tags VALUES (?, ?, ?)', (file_id, method, data))
+
+    def get_all_tags(self, prefix: str):
+        logger.debug(f'Retrieving stored tags under {prefix}...')
+        cur = self.db.execute('''
+            SELECT t.id, t.method, t.data
+            FROM tags t
+            JOIN files f ON f.id = t.id
+            WHERE f.path LIKE ?
+        ''', (prefix + '%',))
+        for file_id, method, data in cur:
+            yield file_id, method, json.loads(zlib.decompress(data))
+
+    def get_tags_count(self, prefix: str):
+        cur = self.db.execute('SELECT count(*) FROM tags t JOIN files f ON f.id = t.id WHERE f.path LIKE ?',
+                              (prefix + '%',))
+        return cur.fetchone()[0]
 
     def set_file_processed(self, file_id: int):
         self.cur.execute('UPDATE files SET processed = 1 WHERE id = ?', (file_id,))
 
+    def set_shard_info(self, mode: str, count: Optional[int], key: str):
+        """Record which shard of which layout this database is, see Federation."""
+        self.db.execute('CREATE TABLE IF NOT EXISTS shard_info (mode TEXT, count INTEGER, key TEXT)')
+        self.db.execute('DELETE FROM shard_info')
+        self.db.execute('INSERT INTO shard_info VALUES (?, ?, ?)', (mode, count, key))
+
+    def add_quarantine(self, path: Path, stage: str, timeout: float):
+        self.cur.execute('INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?, ?)',
+                         (str(path), stage, timeout, datetime.now()))
+
     def commit(self):
         logger.debug("Committing...")
         self.db.commit()
+        if self.disk is not None and self.checkpoint_strategy.attempt():
+            self.write_back()
+
+    def checkpoint(self):
+        """Commit and make the data durable right away, also when staging."""
+        self.db.commit()
+        if self.disk is not None:
+            self.write_back()
+            self.checkpoint_strategy.reset()
+
+    def write_back(self):
+        logger.info('Writing staging database back to disk...')
+        start = time.monotonic()
+        self.db.backup(self.disk)
+        logger.info(f'Written in {time.monotonic() - start:.1f}s')
 
     def close(self):
         logger.debug('Closing database...')
+        if self.disk is not None:
+            # Only committed work is written: a half-done file is redone by the next run.
+            self.db.rollback()
+            self.write_back()
+            self.disk.close()
         self.db.close()
+        if self.staging and self.staging != ':memory:':
+            Path(self.staging).unlink(missing_ok=True)
 
     def get_all_files(self, prefix: str):
         logger.debug(f'Retrieving unprocessed files under {prefix}...')
-        return self.db.execute('SELECT id, path FROM files WHERE processed = 0 and path LIKE ?', (prefix + '%',))
+        return self.db.execute('SELECT id, path FROM files WHERE processed = 0 and path LIKE ? '
+                               'AND path NOT IN (SELECT path FROM quarantine)', (prefix + '%',))
 
     def get_files_count(self, prefix: str):
         logger.debug('Retrieving files count...')
-        cur = self.db.execute('SELECT count(*) FROM files WHERE processed = 0 and path LIKE ?', (prefix + '%',))
+        cur = self.db.execute('SELECT count(*) FROM files WHERE processed = 0 and path LIKE ? '
+                              'AND path NOT IN (SELECT path FROM quarantine)', (prefix + '%',))
         return cur.fetchone()[0]
 
+    def init_content_index(self):
+        """Indexes for find_by_content(); only created when content reuse is requested."""
+        logger.debug('Creating content indexes on "metadata"...')
+        self.db.execute('CREATE INDEX IF NOT EXISTS metadata_hash ON metadata (hash)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS metadata_size_quick_hash ON metadata (size, quick_hash)')
+
+    def find_by_content(self, file_id: int, fi: FileInfo,
+                        versions: Dict[str, int]) -> Optional[Tuple[int, str, int, ExifData]]:
+        """Up-to-date metadata of another file with the same content, matched by hash or size and quick hash."""
+        if fi.hash is not None:
+            condition, params = 'hash = ?', [fi.hash]
+        elif fi.size is not None and fi.quick_hash is not None:
+            condition, params = 'size = ? AND quick_hash = ?', [fi.size, fi.quick_hash]
+        else:
+            return None
+
+        current = ' OR '.join('(method = ? AND method_version >= ?)' for _ in versions)
+        for item in versions.items():
+            params.extend(item)
+
+        exif_names = ', '.join(name for name, _ in EXIF_DATA_COLUMNS)
+        row = self.db.execute(f'''
+            SELECT id, method, method_version, {exif_names}
+            FROM metadata
+            WHERE {condition} AND ({current}) AND id != ?
+            LIMIT 1
+        ''', params + [file_id]).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], row[1], row[2], _exif_data_from_row(row[3:])
+
+    def copy_tags(self, from_file_id: int, to_file_id: int):
+        self.cur.execute('INSERT OR REPLACE INTO tags SELECT ?, method, data FROM tags WHERE id = ?',
+                         (to_file_id, from_file_id))
+
+    def get_outdated_files(self, prefix: str, versions: Dict[str, int], extensions: Set[str],
+                           mime_types: Optional[List[str]]) -> List[Tuple[int, str]]:
+        """Files whose extraction failed, predates versioning or was done by an older reader."""
+        logger.debug(f'Retrieving files to re-extract under {prefix}...')
+
+        outdated = ' OR '.join('(m.method = ? AND m.method_version < ?)' for _ in versions)
+        query = f'''
+            SELECT f.id, f.path
+            FROM files f
+            JOIN metadata m ON f.id = m.id
+            WHERE f.path LIKE ?
+              AND f.path NOT IN (SELECT path FROM quarantine)
+              AND (m.method IS NULL OR m.method_version IS NULL {'OR ' + outdated if outdated else ''})
+        '''
+        params = [prefix + '%']
+        for item in versions.items():
+            params.extend(item)
+
+        if extensions:
+            query += ' AND (' + ' OR '.join('f.path LIKE ?' for _ in extensions) + ')'
+            params.extend('%' + e for e in extensions)
+
+        if mime_types:
+            # Failed rows have no MIME type: the one of the file name extension is used instead.
+            self.db.create_function('guess_mime_type', 1, _guess_mime_type, deterministic=True)
+            query += ' AND (' + ' OR '.join('coalesce(m.mime_type, guess_mime_type(f.path)) LIKE ?'
+                                            for _ in mime_types) + ')'
+            params.extend(t.replace('*', '%') for t in mime_types)
+
+        return self.db.execute(query + ' ORDER BY f.id', params).fetchall()
+
+    def get_metadata_columns(self) -> List[str]:
+        return [r[1] for r in self.db.execute('PRAGMA table_info(metadata)')]
+
     def is_table_exists(self, table: str):
         res = self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
         return bool(res)
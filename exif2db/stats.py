@@ -0,0 +1,45 @@
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Tuple, Dict
+from .types import Db
+
+
+def print_stats(db: Db, root: str):
+    """Print library statistics from the summary tables maintained by the database."""
+    _print_table('Camera', [(f'{make} {model}'.strip(), files, size)
+                            for make, model, files, size in db.get_stats('stats_model')])
+    _print_table('Month', sorted(((f'{year}-{month}' if year else '', files, size)
+                                  for year, month, files, size in db.get_stats('stats_month')), reverse=True))
+    _print_table('MIME type', db.get_stats('stats_mime'))
+    _print_table(f'Folder in {root}', _top_level_folders(db.get_stats('stats_folder'), root))
+
+
+def _top_level_folders(rows: List[tuple], root: str) -> List[Tuple[str, int, int]]:
+    """Roll per-directory counts up to the first level below the root."""
+    root = str(Path(root)).rstrip('/') + '/'
+    totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    for folder, files, size in rows:
+        if not folder.startswith(root):
+            continue
+
+        top = folder[len(root):].split('/')[0] or '.'
+        totals[top][0] += files
+        totals[top][1] += size
+
+    return sorted(((top, files, size) for top, (files, size) in totals.items()), key=lambda r: -r[1])
+
+
+def _print_table(title: str, rows: List[tuple]):
+    print()
+    width = max([len(title)] + [len(str(r[0])) for r in rows])
+    print(f'{title:<{width}}  {"Files":>10}  {"Size":>10}')
+    for name, files, size in rows:
+        print(f'{name or "(unknown)":<{width}}  {files:>10}  {_format_size(size):>10}')
+
+
+def _format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} TB'
@@ -1,6 +1,6 @@
 import time
 from enum import Enum, auto
-from typing import Optional
+from typing import Optional, Dict, Set, List, Tuple
 from abc import ABC
 from dataclasses import dataclass, fields
 from datetime import datetime
@@ -21,6 +21,7 @@ class FileInfo:
     file_date_modified: Optional[datetime]
     size: Optional[int]
     hash: Optional[str]
+    quick_hash: Optional[str]
 
 
 @dataclass
@@ -110,10 +111,45 @@ class TimeOrCountLimit(CommitStrategy):
 
 
 class Db(ABC):
-    def add_file(self, path: Path):
+    def add_file(self, path: Path) -> bool:
         ...
 
-    def add_metadata(self, file_id: int, fi: FileInfo, exif: ExifData, method: str):
+    def init_path_index(self):
+        ...
+
+    def start_scan(self):
+        ...
+
+    def end_scan(self, prefix: str) -> List[Tuple[int, str]]:
+        ...
+
+    def delete_file(self, file_id: int):
+        ...
+
+    def add_metadata(self, file_id: int, fi: FileInfo, exif: ExifData, method: str, version: int):
+        ...
+
+    def update_metadata(self, file_id: int, fi: FileInfo, exif: ExifData, method: str, version: int):
+        ...
+
+    def find_by_content(self, file_id: int, fi: FileInfo,
+                        versions: Dict[str, int]) -> Optional[Tuple[int, str, int, ExifData]]:
+        ...
+
+    def copy_tags(self, from_file_id: int, to_file_id: int):
+        ...
+
+    def get_stats(self, table: str) -> List[tuple]:
+        ...
+
+    def set_shard_info(self, mode: str, count: Optional[int], key: str):
+        ...
+
+    def add_quarantine(self, path: Path, stage: str, timeout: float):
+        ...
+
+    def get_outdated_files(self, prefix: str, versions: Dict[str, int], extensions: Set[str],
+                           mime_types: Optional[List[str]]) -> List[Tuple[int, str]]:
         ...
 
     def reset_files_data(self):
@@ -125,6 +161,9 @@ class Db(ABC):
     def commit(self):
         pass
 
+    def checkpoint(self):
+        pass
+
     def close(self):
         pass
 
@@ -134,20 +173,48 @@ class Db(ABC):
     def get_files_count(self, prefix: str):
         ...
 
+    def add_tags(self, file_id: int, method: str, tags: dict):
+        ...
+
+    def get_all_tags(self, prefix: str):
+        ...
+
+    def get_tags_count(self, prefix: str):
+        ...
+
+    def update_exif_data(self, file_id: int, exif: ExifData, version: int):
+        ...
+
+    def sync_metadata_columns(self):
+        ...
+
 
 class ExifReader(ABC):
     _method: Method = Method.NotSet
+    # Bump in a concrete reader when its mapping changes, so that --reextract picks its rows up.
+    _version: Optional[int] = None
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, data: Optional[bytes] = None):
         self.path = path
+        self.data = data    # File content if it was already read, readers may use it instead of the path.
+        self.tags: Optional[dict] = None    # Full tag set seen by load(), JSON-serializable.
 
     def load(self):
         ...
 
+    @classmethod
+    def from_tags(cls, tags: dict) -> ExifData:
+        """Map a tag set captured by load() to ExifData without reading the file."""
+        ...
+
     @property
     def method(self):
         return self._method
 
+    @property
+    def version(self):
+        return self._version
+
 
 class ExifError(Exception):
     pass
@@ -155,3 +222,12 @@ class ExifError(Exception):
 
 class MethodNotFoundError(Exception):
     pass
+
+
+class ExtractionTimeout(BaseException):
+    """Raised when a reader exceeds its time budget.
+
+    Derived from BaseException so that broad ``except Exception`` handlers in
+    readers and libraries do not swallow it.
+    """
+    pass
@@ -1,6 +1,9 @@
+import signal
+import threading
+from contextlib import contextmanager
 from typing import Union, Optional
 from datetime import datetime
-from .types import Method, MethodNotFoundError
+from .types import Method, MethodNotFoundError, ExtractionTimeout
 
 
 def dms2dd(degrees: int, minutes: int, seconds: int, direction: str) -> float:
@@ -23,6 +26,31 @@ def parse_exif_date(date: str, sub_sec: Union[str, int] = '000000') -> Optional[
         return datetime.strptime(date, '%Y:%m:%d %H:%M:%S')
 
 
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    """Raise ExtractionTimeout in the block if it runs longer than the limit.
+
+    Relies on SIGALRM, so it is a no-op on platforms without it and outside of
+    the main thread. C code that does not return to the interpreter cannot be
+    interrupted this way.
+    """
+    if not seconds or not hasattr(signal, 'setitimer') \
+            or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise ExtractionTimeout(seconds)
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
 def parse_method(method: str) -> Method:
     try:
         return Method[method.capitalize()]
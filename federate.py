@@ -0,0 +1,25 @@
+import csv
+import sys
+from argparse import ArgumentParser
+from exif2db.federation import Federation
+
+
+parser = ArgumentParser('federate', 'Query all shards of an exif2db DB created with --shard')
+parser.add_argument('database', help='Database given to exif2db with --shard, e.g. ./sqlite.db')
+parser.add_argument('query', help='File with an SQL query, e.g. queries/compare.sql. '
+                                  'Without it, shards and their file counts are listed.', nargs='?')
+args = parser.parse_args()
+
+federation = Federation(args.database)
+
+if args.query:
+    with open(args.query) as f:
+        cur = federation.execute(f.read())
+else:
+    cur = federation.execute('SELECT shard, count(*) AS files FROM files GROUP BY shard ORDER BY shard')
+
+out = csv.writer(sys.stdout)
+out.writerow(d[0] for d in cur.description)
+out.writerows(cur)
+
+federation.close()
@@ -11,11 +11,14 @@ args = parser.parse_args()
 src = Sqlite(args.source)
 dst = Sqlite(args.destination)
 
+# Matched by name: column order differs between databases created by different versions.
+metadata_columns = src.get_metadata_columns()
+
 for fm in tqdm(src.get_all_raw()):
     dst.file_num += 1
     path, status = fm[1:3]
     dst.add_file_raw(dst.file_num, path, status)
     if fm[3] is not None:
-        dst.add_metadata_raw((dst.file_num,) + fm[4:])
+        dst.add_metadata_raw((dst.file_num,) + fm[4:], metadata_columns)
 
 dst.commit()